@@ -1,15 +1,33 @@
 # memory_service/main.py
 import asyncio
+import os
+import orjson
 import socketio
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from contextlib import asynccontextmanager
 from memory_manager import MemoryManager
 
 HUB_URL = 'http://localhost:8002'
+# Max queries scored at once; each runs on a worker thread off the event loop
+QUERY_CONCURRENCY = int(os.environ.get("MEMORY_QUERY_CONCURRENCY", "4"))
+
+class OrjsonCodec:
+    """Drop-in for the json module that python-socketio uses to encode packets."""
+
+    @staticmethod
+    def dumps(obj, **kwargs):
+        # socketio passes json-module kwargs (separators=...); orjson output is already compact
+        return orjson.dumps(obj).decode()
+
+    @staticmethod
+    def loads(data, **kwargs):
+        return orjson.loads(data)
 
 # Use AsyncClient so it plays nice with FastAPI's event loop
-sio = socketio.AsyncClient()
+sio = socketio.AsyncClient(json=OrjsonCodec)
 manager = MemoryManager()
+query_slots = asyncio.Semaphore(QUERY_CONCURRENCY)
 
 async def connect_to_hub():
     """Background task to keep the Hub connection alive."""
@@ -34,7 +52,7 @@ async def lifespan(app: FastAPI):
     task.cancel()
 
 # This is the "app" that Uvicorn is looking for!
-app = FastAPI(title="Nami Memory Service", lifespan=lifespan)
+app = FastAPI(title="Nami Memory Service", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 @app.get("/health")
 async def health():
@@ -51,7 +69,7 @@ async def disconnect():
 
 @sio.on("save_memory")
 async def on_save_memory(data):
-    manager.add_memory(data)
+    await asyncio.to_thread(manager.add_memory, data)
 
 @sio.on("query_memories")
 async def on_query_memories(data):
@@ -60,10 +78,28 @@ async def on_query_memories(data):
     request_id = data.get("request_id", "unknown")
     
     print(f"🔍 [Query] Searching for: '{query[:30]}...'")
-    results = manager.retrieve(query, limit)
+    async with query_slots:
+        # Encoding and scoring are CPU-bound; keep the Hub connection responsive
+        results = await asyncio.to_thread(manager.retrieve, query, limit)
     
     await sio.emit("memory_results", {
         "request_id": request_id,
         "memories": results
     })
-    print(f"📤 [Query] Sent {len(results)} results back to Hub.")
\ No newline at end of file
+    print(f"📤 [Query] Sent {len(results)} results back to Hub.")
+
+@sio.on("query_memories_batch")
+async def on_query_memories_batch(data):
+    queries = data.get("queries", [])
+    limit = data.get("limit", 5)
+    request_id = data.get("request_id", "unknown")
+
+    print(f"🔍 [Query] Batch of {len(queries)} queries")
+    async with query_slots:
+        results = await asyncio.to_thread(manager.retrieve_batch, queries, limit)
+
+    await sio.emit("memory_results_batch", {
+        "request_id": request_id,
+        "results": results
+    })
+    print(f"📤 [Query] Sent {len(results)} result sets back to Hub.")
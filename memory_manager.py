@@ -1,88 +1,290 @@
 # memory_service/memory_manager.py
+import re
+import sys
+import threading
 import time
+import numpy as np
+import torch
 from typing import List, Dict, Any
-from semantic_memory import SemanticMemoryRetriever
+from semantic_memory import SemanticMemoryRetriever, SemanticQueryCache
+from scoring import hybrid_scores
+from rwlock import RWLock
 
 MEMORY_DECAY_RATE = 0.05  # Adjust as needed
+DECAY_INTERVAL_SECONDS = 60.0
+MAX_MEMORIES = 50_000  # Oldest memories are evicted beyond this
+INITIAL_CAPACITY = 256
+
+# Runs of 5+ letters (any script); punctuation no longer sticks to words
+_TOKEN_RE = re.compile(r"[^\W\d_]{5,}")
+
+def _keyword_tokens(text: str) -> frozenset:
+    """Lowercased words of 5+ letters, used for the keyword boost."""
+    return frozenset(_TOKEN_RE.findall(text.lower()))
+
+def _stored_keyword_tokens(text: str) -> frozenset:
+    """Like _keyword_tokens, but interned: the same word across memories is one str object."""
+    return frozenset(map(sys.intern, _TOKEN_RE.findall(text.lower())))
+
+def _is_short_query(query_context: str) -> bool:
+    return not query_context or len(query_context.strip()) < 5
+
+def _report_decay(decayed_count: int):
+    if decayed_count > 0:
+        print(f"🧠 [Memory] Decayed {decayed_count} memories.")
 
 class MemoryManager:
-    def __init__(self):
+    def __init__(self, max_memories: int = MAX_MEMORIES, expected_capacity: int = INITIAL_CAPACITY):
+        self.max_memories = max_memories
+        # Preallocate for the expected memory count so early saves never regrow the columns.
+        # Eviction runs before the insert, so at most max_memories rows are ever live.
+        capacity = max(1, min(expected_capacity, max_memories))
+        # Row i of every column below describes self.memories[i]
         self.memories: List[Dict[str, Any]] = []
-        self.semantic_retriever = SemanticMemoryRetriever()
-        self.last_decay_time = time.time()
+        self._token_sets: List[frozenset] = []
+        self._rows: Dict[str, int] = {}  # {memory_id: row in self.memories}
+        # Authoritative importance scores; the dicts' 'importance' is refreshed when returned
+        self._importance = np.zeros(capacity, dtype=np.float32)
+        # Timestamps as float32 seconds since _epoch, so recency math stays in float32
+        self._epoch = time.time()
+        self._timestamps = np.zeros(capacity, dtype=np.float32)
+        self.semantic_retriever = SemanticMemoryRetriever(capacity=capacity)
+        self.query_cache = SemanticQueryCache(self.semantic_retriever.dim, self.semantic_retriever.device)
+        self._version = 0  # bumped under the write lock whenever memories or their embeddings change
+        self.last_decay_time = time.monotonic()  # immune to wall-clock jumps
+        # Queries run on worker threads: scoring shares the read side, mutations take the write side
+        self._lock = RWLock()
+        self._rlock = self._lock.reader
+        self._wlock = self._lock.writer
+        # Serializes embedding new memories, which runs outside _lock.
+        # Lock order: _embed_lock, then _lock — never the reverse.
+        self._embed_lock = threading.Lock()
 
-    def add_memory(self, memory_data: Dict[str, Any]):
-        """Expects dict with: id, timestamp, text, memory_text, importance"""
-        # Prevent duplicates
-        if not any(m['id'] == memory_data['id'] for m in self.memories):
+    def add_memory(self, memory_data: Dict[str, Any]) -> bool:
+        """Expects dict with: id, timestamp, text, memory_text, importance. Returns False for duplicates,
+        and when full for memories older than everything already stored."""
+        # Prevent duplicates without waiting for in-flight queries to drain
+        with self._rlock:
+            if memory_data['id'] in self._rows:
+                return False
+
+        with self._wlock:
+            # Re-check: another save of the same id may have won the race
+            if memory_data['id'] in self._rows:
+                return False
             # Ensure it has an importance score
             if 'importance' not in memory_data:
                 memory_data['importance'] = 0.5 
-            self.memories.append(memory_data)
-            print(f"💾 [Storage] Saved memory: {memory_data.get('memory_text', memory_data.get('text'))[:40]}...")
+            content = memory_data.get('memory_text') or memory_data.get('text', '')
+            timestamp = np.float32(memory_data['timestamp'] - self._epoch)
+
+            # When full, make room by evicting among the existing rows only; a save
+            # older than all of them would be the victim itself, so it is refused
+            refused = False
+            evicted = None
+            if len(self.memories) >= self.max_memories:
+                oldest = int(np.argmin(self._timestamps[:len(self.memories)])) if self.memories else None
+                if oldest is None or timestamp < self._timestamps[oldest]:
+                    refused = True
+                else:
+                    evicted = self.memories[oldest]['id']
+                    self._remove_row(oldest)
+
+            if not refused:
+                row = len(self.memories)
+                if row == len(self._importance):
+                    self._grow_columns()
+                self._importance[row] = memory_data['importance']
+                self._timestamps[row] = timestamp
+                self._rows[memory_data['id']] = row
+                self.memories.append(memory_data)
+                self._token_sets.append(_stored_keyword_tokens(content))
+                self.semantic_retriever.register(memory_data['id'], content)
+                self._version += 1
+
+        # Log outside the lock so a slow stdout never stalls other threads
+        if refused:
+            print(f"🗑️ [Storage] Dropped memory {memory_data['id']}: older than every stored memory (cap {self.max_memories}).")
+            return False
+        print(f"💾 [Storage] Saved memory: {content[:40]}...")
+        if evicted is not None:
+            print(f"🗑️ [Storage] Evicted oldest memory {evicted} (cap {self.max_memories}).")
+        return True
+
+    def remove_memory(self, memory_id: str):
+        with self._wlock:
+            row = self._rows.get(memory_id)
+            if row is not None:
+                self._remove_row(row)
+
+    def _remove_row(self, row: int):
+        """Caller holds the write lock."""
+        memory_id = self.memories[row]['id']
+        del self._rows[memory_id]
+        # Mirror the retriever's swap-remove so row i stays the same memory in both
+        last = self.memories.pop()
+        last_tokens = self._token_sets.pop()
+        if row < len(self.memories):
+            last_row = len(self.memories)
+            self._importance[row] = self._importance[last_row]
+            self._timestamps[row] = self._timestamps[last_row]
+            self.memories[row] = last
+            self._token_sets[row] = last_tokens
+            self._rows[last['id']] = row
+        self.semantic_retriever.forget(memory_id)
+        self._version += 1
+
+    def _grow_columns(self):
+        """Doubles the capacity of the numeric columns."""
+        self._importance = np.concatenate([self._importance, np.zeros_like(self._importance)])
+        self._timestamps = np.concatenate([self._timestamps, np.zeros_like(self._timestamps)])
 
     def decay_memories(self):
-        now = time.time()
-        minutes_passed = (now - self.last_decay_time) / 60.0
-        
-        if minutes_passed < 1.0: 
-            return 
-        
-        decay_amount = minutes_passed * MEMORY_DECAY_RATE
+        with self._wlock:
+            decayed_count = self._decay()
+        _report_decay(decayed_count)
+
+    def _decay_due(self) -> bool:
+        # Unlocked peek; _decay() re-checks under the write lock
+        return time.monotonic() - self.last_decay_time >= DECAY_INTERVAL_SECONDS
+
+    def _decay(self) -> int:
+        """Applies decay if the interval has passed; returns how many memories decayed."""
+        now = time.monotonic()
+        elapsed = now - self.last_decay_time
+
+        if elapsed < DECAY_INTERVAL_SECONDS:
+            return 0
+
+        decay_amount = (elapsed / 60.0) * MEMORY_DECAY_RATE
         self.last_decay_time = now
-        decayed_count = 0
-        
-        for mem in self.memories:
-            old_score = mem['importance']
-            factor = 0.5 if old_score > 0.9 else 1.0
-            mem['importance'] = max(0.1, old_score - (decay_amount * factor))
-            if mem['importance'] < old_score:
-                decayed_count += 1
-                
-        if decayed_count > 0:
-            print(f"🧠 [Memory] Decayed {decayed_count} memories.")
+
+        # In place on the float32 column: no temporaries beyond the step array.
+        # Caller holds the write lock, so queries and saves wait for this pass.
+        scores = self._importance[:len(self.memories)]
+        floor = np.float32(0.1)
+        decayed_count = int(np.count_nonzero(scores > floor))
+        step = np.where(scores > np.float32(0.9), np.float32(decay_amount * 0.5), np.float32(decay_amount))
+        np.subtract(scores, step, out=scores)
+        np.maximum(scores, floor, out=scores)
+        return decayed_count
 
     def retrieve(self, query_context: str, limit: int = 5) -> List[Dict[str, Any]]:
-        self.decay_memories()
+        self._prepare_for_read()
+
+        # Encode before taking the read side so a forward pass never holds up saves
+        query_embedding = None
+        if not _is_short_query(query_context):
+            query_embedding = self.semantic_retriever.embed_query(query_context)
 
-        if not self.memories:
+        with self._rlock:
+            if not self.memories:
+                return []
+
+            if query_embedding is None:
+                return self._top_by_importance(limit)
+
+            cached_ids = self.query_cache.lookup(query_embedding, limit, self._version)
+            if cached_ids is not None:
+                return self._collect([self._rows[mem_id] for mem_id in cached_ids])
+
+            sem_scores = self.semantic_retriever.similarities(query_embedding)
+            results = self._rank(query_context, sem_scores, limit)
+            self.query_cache.store(query_embedding, limit, self._version, [m['id'] for m in results])
+            return results
+
+    def retrieve_batch(self, query_contexts: List[str], limit: int = 5) -> List[List[Dict[str, Any]]]:
+        """Same as retrieve() for several queries, sharing one encode and one matmul."""
+        self._prepare_for_read()
+
+        semantic_queries = [q for q in query_contexts if not _is_short_query(q)]
+        query_embeddings = None
+        if semantic_queries:
+            query_embeddings = self.semantic_retriever.embed_queries(semantic_queries)
+
+        with self._rlock:
+            if not self.memories:
+                return [[] for _ in query_contexts]
+
+            sem_rows = iter(())
+            if query_embeddings is not None:
+                sem_rows = iter(self.semantic_retriever.similarities_batch(query_embeddings))
+
+            results = []
+            for query_context in query_contexts:
+                if _is_short_query(query_context):
+                    results.append(self._top_by_importance(limit))
+                else:
+                    results.append(self._rank(query_context, next(sem_rows), limit))
+            return results
+
+    def _prepare_for_read(self):
+        """Applies pending decay and embeds new memories so queries can run as pure reads."""
+        # Only take the write side when there is decay to apply
+        if self._decay_due():
+            with self._wlock:
+                decayed_count = self._decay()
+            _report_decay(decayed_count)
+
+        # Nothing queued and no encode in flight: rows are all stored, skip the locks.
+        # Check in this order: take_pending() empties the queue only while holding
+        # _embed_lock, so an empty queue with the lock free means nothing is half-done.
+        if not self.semantic_retriever.has_pending() and not self._embed_lock.locked():
+            return
+
+        # Held across take/encode/store so no query scores against half-embedded rows,
+        # while saves, decay and already-prepared queries keep using _lock meanwhile
+        with self._embed_lock:
+            with self._wlock:
+                pending = self.semantic_retriever.take_pending()
+            if not pending:
+                return
+            embeddings = self.semantic_retriever.encode_pending(pending)
+            with self._wlock:
+                self.semantic_retriever.store_embeddings(pending, embeddings)
+                # Cached results scored these rows as zeros; retire them
+                self._version += 1
+
+    def _top_by_importance(self, limit: int) -> List[Dict[str, Any]]:
+        # Fall back to importance-based retrieval
+        importance = self._importance[:len(self.memories)]
+        k = min(limit, importance.size)
+        if k <= 0:
             return []
-            
-        if not query_context or len(query_context.strip()) < 5:
-            # Fall back to importance-based retrieval
-            return sorted(self.memories, key=lambda m: m['importance'], reverse=True)[:limit]
-
-        # 1. Get Semantic Scores
-        semantic_results = self.semantic_retriever.rank_memories(query_context, self.memories)
-        semantic_map = {mem['id']: score for score, mem in semantic_results}
-        
-        scored_memories = []
-        now = time.time()
-        
-        for mem in self.memories:
-            sem_score = semantic_map.get(mem['id'], 0.0)
-            imp_score = mem['importance']
-            
-            # Recency Score
-            age_hours = (now - mem['timestamp']) / 3600.0
-            recency_score = max(0.0, 1.0 - (age_hours / 24.0))
-            
-            # Hybrid Formula: Meaning > Importance > Time
-            final_score = (sem_score * 0.6) + (imp_score * 0.3) + (recency_score * 0.1)
-            
-            if sem_score > 0.8:
-                final_score += 0.2
-            
-            # Keyword boost
-            query_lower = query_context.lower()
-            mem_text_lower = (mem.get('memory_text') or mem.get('text', '')).lower()
-            query_words = set(w for w in query_lower.split() if len(w) > 4)
-            mem_words = set(w for w in mem_text_lower.split() if len(w) > 4)
-            
-            if query_words & mem_words:
-                final_score += min(0.15, len(query_words & mem_words) * 0.05)
-                
-            scored_memories.append((final_score, mem))
-            
-        scored_memories.sort(key=lambda x: x[0], reverse=True)
-        return [m[1] for m in scored_memories[:limit]]
\ No newline at end of file
+        # Highest importance first, ties by row. Every row tied with the k-th
+        # score is a candidate, so the row order among ties is deterministic.
+        neg = -importance
+        kth = np.partition(neg, k - 1)[k - 1]
+        candidates = np.flatnonzero(neg <= kth)  # ascending rows
+        top = candidates[np.argsort(neg[candidates], kind='stable')[:k]]
+        return self._collect(top.tolist())
+
+    def _rank(self, query_context: str, sem_scores: torch.Tensor, limit: int) -> List[Dict[str, Any]]:
+        """Hybrid ranking; sem_scores rows line up with self.memories."""
+        count = len(self.memories)
+        now = time.time() - self._epoch
+
+        # Keyword boost
+        query_words = _keyword_tokens(query_context)
+        overlaps = np.fromiter(
+            map(len, map(query_words.intersection, self._token_sets)),
+            dtype=np.float32,
+            count=len(self._token_sets),
+        )
+
+        final_scores = hybrid_scores(
+            sem_scores.numpy(), self._importance[:count], self._timestamps[:count], overlaps, now
+        )
+
+        top = torch.topk(torch.from_numpy(final_scores), min(limit, count)).indices
+        return self._collect(top.tolist())
+
+    def _collect(self, rows: List[int]) -> List[Dict[str, Any]]:
+        """Returns the memories at `rows` with their current importance written back."""
+        results = []
+        for row in rows:
+            mem = self.memories[row]
+            # float32 storage; round so the Hub doesn't see 0.699999988 for 0.7
+            mem['importance'] = round(float(self._importance[row]), 6)
+            results.append(mem)
+        return results
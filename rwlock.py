@@ -0,0 +1,62 @@
+# memory_service/rwlock.py
+import threading
+
+class RWLock:
+    """Any number of concurrent readers, or a single writer.
+
+    Writer-preferring: once a writer is waiting, new readers queue behind it,
+    so a steady stream of queries cannot starve saves. The internal mutex is
+    only held to update counters, never for the duration of a read or write.
+    Use `with lock.reader:` / `with lock.writer:`.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writers_waiting = 0
+        self._writer_active = False
+        self.reader = _ReadSide(self)
+        self.writer = _WriteSide(self)
+
+    def acquire_read(self):
+        with self._cond:
+            self._cond.wait_for(lambda: not self._writer_active and not self._writers_waiting)
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            self._cond.wait_for(lambda: not self._writer_active and not self._readers)
+            self._writers_waiting -= 1
+            self._writer_active = True
+
+    def release_write(self):
+        with self._cond:
+            self._writer_active = False
+            self._cond.notify_all()
+
+class _ReadSide:
+    def __init__(self, lock: RWLock):
+        self._lock = lock
+
+    def __enter__(self):
+        self._lock.acquire_read()
+
+    def __exit__(self, *exc):
+        self._lock.release_read()
+
+class _WriteSide:
+    def __init__(self, lock: RWLock):
+        self._lock = lock
+
+    def __enter__(self):
+        self._lock.acquire_write()
+
+    def __exit__(self, *exc):
+        self._lock.release_write()
@@ -0,0 +1,75 @@
+# memory_service/scoring.py
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:  # Numba is optional; the NumPy path computes the same float32 scores
+    njit = None
+
+# Hybrid Formula: Meaning > Importance > Time
+SEMANTIC_WEIGHT = 0.6
+IMPORTANCE_WEIGHT = 0.3
+RECENCY_WEIGHT = 0.1
+STRONG_MATCH_THRESHOLD = 0.8
+STRONG_MATCH_BONUS = 0.2
+KEYWORD_BONUS = 0.05  # per shared keyword
+KEYWORD_BONUS_MAX = 0.15
+RECENCY_WINDOW_HOURS = 24.0
+
+def _hybrid_scores_numpy(sem, imp, ts, overlaps, now):
+    # Recency Score
+    age_hours = (now - ts) * np.float32(1 / 3600.0)
+    recency = np.clip(1.0 - age_hours * np.float32(1 / RECENCY_WINDOW_HOURS), 0.0, None)
+
+    # Keyword boost
+    keyword_boost = np.minimum(overlaps * np.float32(KEYWORD_BONUS), np.float32(KEYWORD_BONUS_MAX))
+
+    # Branchless: the strong-match bonus is a mask multiply
+    return (
+        np.float32(SEMANTIC_WEIGHT) * sem
+        + np.float32(IMPORTANCE_WEIGHT) * imp.astype(np.float32, copy=False)
+        + np.float32(RECENCY_WEIGHT) * recency
+        + np.float32(STRONG_MATCH_BONUS) * (sem > STRONG_MATCH_THRESHOLD).astype(np.float32)
+        + keyword_boost
+    )
+
+if njit is not None:
+    # float32 copies of the constants: Numba would otherwise promote every term to float64
+    _F32_SEMANTIC_WEIGHT = np.float32(SEMANTIC_WEIGHT)
+    _F32_IMPORTANCE_WEIGHT = np.float32(IMPORTANCE_WEIGHT)
+    _F32_RECENCY_WEIGHT = np.float32(RECENCY_WEIGHT)
+    _F32_STRONG_MATCH_THRESHOLD = np.float32(STRONG_MATCH_THRESHOLD)
+    _F32_STRONG_MATCH_BONUS = np.float32(STRONG_MATCH_BONUS)
+    _F32_KEYWORD_BONUS = np.float32(KEYWORD_BONUS)
+    _F32_KEYWORD_BONUS_MAX = np.float32(KEYWORD_BONUS_MAX)
+    _F32_INV_HOUR = np.float32(1 / 3600.0)
+    _F32_INV_WINDOW = np.float32(1 / RECENCY_WINDOW_HOURS)
+    _F32_ONE = np.float32(1.0)
+    _F32_ZERO = np.float32(0.0)
+
+    # Serial and without fastmath: queries call this from several threads at once,
+    # which Numba's default parallel threading layer does not survive; nogil lets
+    # those calls actually overlap instead.
+    @njit(nogil=True, cache=True)
+    def _hybrid_scores_numba(sem, imp, ts, overlaps, now):
+        # One pass over the columns instead of one temporary array per term,
+        # with the same float32 operations in the same order as the NumPy path
+        n = sem.shape[0]
+        out = np.empty(n, dtype=np.float32)
+        for i in range(n):
+            s = sem[i]
+            recency = _F32_ONE - ((now - ts[i]) * _F32_INV_HOUR) * _F32_INV_WINDOW
+            if recency < _F32_ZERO:
+                recency = _F32_ZERO
+            keyword_boost = min(overlaps[i] * _F32_KEYWORD_BONUS, _F32_KEYWORD_BONUS_MAX)
+            score = _F32_SEMANTIC_WEIGHT * s + _F32_IMPORTANCE_WEIGHT * imp[i] + _F32_RECENCY_WEIGHT * recency
+            if s > _F32_STRONG_MATCH_THRESHOLD:
+                score += _F32_STRONG_MATCH_BONUS
+            out[i] = score + keyword_boost
+        return out
+
+def hybrid_scores(sem: np.ndarray, imp: np.ndarray, ts: np.ndarray, overlaps: np.ndarray, now: float) -> np.ndarray:
+    """Final retrieval score per memory as float32; all inputs are row-aligned columns."""
+    if njit is not None:
+        return _hybrid_scores_numba(sem, imp, ts, overlaps, np.float32(now))
+    return _hybrid_scores_numpy(sem, imp, ts, overlaps, np.float32(now))
@@ -1,53 +1,206 @@
 # memory_service/semantic_memory.py
-from sentence_transformers import SentenceTransformer, util
+import os
+import threading
+import time
+from sentence_transformers import SentenceTransformer
 import torch
-from typing import List, Tuple, Dict, Any
+from collections import OrderedDict
+from typing import List, Dict, Optional, Tuple
+
+ENCODE_BATCH_SIZE = 64
+INITIAL_CORPUS_CAPACITY = 256
+CORPUS_GROWTH_FACTOR = 1.5
+# Stored embeddings are half precision to halve the bytes read per query
+EMBEDDING_DTYPE = torch.float16
+EMBEDDING_CACHE_MAX = 1024  # Query embeddings kept for repeated query text
+SEMANTIC_CACHE_SIZE = 128  # Recent query results reused for near-duplicate queries
+SEMANTIC_CACHE_THRESHOLD = 0.97
+SEMANTIC_CACHE_TTL = 60.0  # seconds
+
+def _pick_device() -> str:
+    """EMBEDDING_DEVICE wins; otherwise CUDA if present, else CPU. MPS is opt-in only."""
+    override = os.environ.get("EMBEDDING_DEVICE")
+    if override:
+        return override
+    return 'cuda' if torch.cuda.is_available() else 'cpu'
 
 class SemanticMemoryRetriever:
-    def __init__(self, model_name='all-MiniLM-L6-v2'):
+    def __init__(self, model_name='all-MiniLM-L6-v2', device=None, capacity=INITIAL_CORPUS_CAPACITY):
+        self.device = device or _pick_device()
         print(f"🧠 [Semantic] Loading embedding model: {model_name}...")
-        self.model = SentenceTransformer(model_name, device='cpu')
-        self.embedding_cache = {}  # {memory_id: embedding_tensor}
-        print(f"✅ [Semantic] Model loaded (CPU Enforced).")
-
-    def _get_embedding(self, text: str):
-        return self.model.encode(text, convert_to_tensor=True)
-
-    def rank_memories(self, query_text: str, memories: List[Dict[str, Any]]) -> List[Tuple[float, Dict[str, Any]]]:
-        """Ranks a list of memory dicts based on semantic similarity to the query."""
-        if not memories or not query_text:
-            return []
-            
-        # Clean cache of deleted memories
-        current_ids = {m['id'] for m in memories}
-        self.embedding_cache = {k: v for k, v in self.embedding_cache.items() if k in current_ids}
-        
-        memory_embeddings = []
-        valid_memories = []
-        
-        for mem in memories:
-            content = mem.get('memory_text') or mem.get('text', '')
-            if not content: 
-                continue
-                
-            mem_id = mem['id']
-            if mem_id not in self.embedding_cache:
-                self.embedding_cache[mem_id] = self._get_embedding(content)
-            
-            memory_embeddings.append(self.embedding_cache[mem_id])
-            valid_memories.append(mem)
-            
-        if not valid_memories:
-            return []
-
-        query_embedding = self._get_embedding(query_text)
-        
-        # Calculate Cosine Similarities
-        corpus_embeddings = torch.stack(memory_embeddings)
-        cos_scores = util.cos_sim(query_embedding, corpus_embeddings)[0]
-        
-        results = []
-        for idx, score in enumerate(cos_scores):
-            results.append((float(score), valid_memories[idx]))
-            
-        return results
\ No newline at end of file
+        self.model = SentenceTransformer(model_name, device=self.device)
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+        # Resident corpus: row i holds the unit-norm embedding of self._ids[i]
+        self._corpus = torch.zeros((capacity, self.dim), dtype=EMBEDDING_DTYPE, device=self.device)
+        self._size = 0
+        self._ids: List[str] = []
+        self._rows: Dict[str, int] = {}  # {memory_id: row}
+        self._pending: Dict[str, str] = {}  # {memory_id: text} awaiting a batched encode
+        self._query_cache: "OrderedDict[str, torch.Tensor]" = OrderedDict()  # LRU {query_text: embedding}
+        self._query_cache_lock = threading.Lock()  # queries embed concurrently
+        print(f"✅ [Semantic] Model loaded on {self.device}.")
+
+    def _get_embedding(self, text):
+        # Every vector must be unit-norm: similarities() relies on dot product == cosine
+        return self.model.encode(
+            text,
+            batch_size=ENCODE_BATCH_SIZE,
+            convert_to_tensor=True,
+            normalize_embeddings=True,
+            show_progress_bar=False,
+        )
+
+    def _query_embeddings(self, query_texts: List[str]) -> torch.Tensor:
+        """Stacked query embeddings; LRU misses are encoded together in one batch."""
+        found = {}
+        missing = []
+        with self._query_cache_lock:
+            for query_text in dict.fromkeys(query_texts):
+                embedding = self._query_cache.get(query_text)
+                if embedding is None:
+                    missing.append(query_text)
+                else:
+                    self._query_cache.move_to_end(query_text)
+                    found[query_text] = embedding
+
+        if missing:
+            embeddings = self._get_embedding(missing)
+            with self._query_cache_lock:
+                for query_text, embedding in zip(missing, embeddings):
+                    found[query_text] = embedding
+                    self._query_cache[query_text] = embedding
+                    if len(self._query_cache) > EMBEDDING_CACHE_MAX:
+                        self._query_cache.popitem(last=False)
+
+        return torch.stack([found[query_text] for query_text in query_texts])
+
+    def _ensure_capacity(self, needed: int):
+        capacity = self._corpus.shape[0]
+        if needed <= capacity:
+            return
+        new_capacity = max(needed, int(capacity * CORPUS_GROWTH_FACTOR))
+        grown = torch.zeros((new_capacity, self.dim), dtype=self._corpus.dtype, device=self.device)
+        grown[:self._size] = self._corpus[:self._size]
+        self._corpus = grown
+
+    def register(self, mem_id: str, text: str):
+        """Adds a memory to the corpus. Encoding is deferred until the next query."""
+        if mem_id in self._rows:
+            return
+        row = self._size
+        self._ensure_capacity(row + 1)
+        # Memories without text keep a zero row, so they always score 0.0
+        self._corpus[row].zero_()
+        self._rows[mem_id] = row
+        self._ids.append(mem_id)
+        self._size += 1
+        if text:
+            self._pending[mem_id] = text
+
+    def forget(self, mem_id: str):
+        """Removes a memory by moving the last row into its slot."""
+        row = self._rows.pop(mem_id, None)
+        if row is None:
+            return
+        self._pending.pop(mem_id, None)
+
+        last = self._size - 1
+        if row != last:
+            moved_id = self._ids[last]
+            self._corpus[row] = self._corpus[last]
+            self._ids[row] = moved_id
+            self._rows[moved_id] = row
+        self._ids.pop()
+        self._size -= 1
+
+    def has_pending(self) -> bool:
+        """Cheap unlocked check for memories not yet handed to take_pending()."""
+        return bool(self._pending)
+
+    def take_pending(self) -> Dict[str, str]:
+        """Hands over the memories awaiting an encode ({memory_id: text})."""
+        pending, self._pending = self._pending, {}
+        return pending
+
+    def encode_pending(self, pending: Dict[str, str]) -> torch.Tensor:
+        """Batched encode of take_pending() output; touches no shared state."""
+        return self._get_embedding(list(pending.values()))
+
+    def store_embeddings(self, pending: Dict[str, str], embeddings: torch.Tensor):
+        """Writes encoded rows, skipping memories forgotten since take_pending()."""
+        live = [(self._rows[mem_id], i) for i, mem_id in enumerate(pending) if mem_id in self._rows]
+        if not live:
+            return
+        rows = torch.tensor([row for row, _ in live], device=self.device)
+        picks = torch.tensor([i for _, i in live], device=embeddings.device)
+        self._corpus[rows] = embeddings[picks].to(EMBEDDING_DTYPE)
+
+    def embed_query(self, query_text: str) -> torch.Tensor:
+        return self._query_embeddings([query_text])[0]
+
+    def embed_queries(self, query_texts: List[str]) -> torch.Tensor:
+        return self._query_embeddings(query_texts)
+
+    def similarities(self, query_embedding: torch.Tensor) -> torch.Tensor:
+        """Cosine similarity of the query against every registered memory, in corpus row order (on CPU).
+
+        Only reads the corpus, so it is safe to run concurrently. Memories still
+        awaiting take_pending()/store_embeddings() score 0.0 until they are stored.
+        """
+        if not self._size:
+            return torch.zeros(self._size)
+
+        # Embeddings are unit-norm, so cosine similarity is a plain dot product
+        return torch.mv(self._corpus[:self._size], query_embedding.to(EMBEDDING_DTYPE)).float().cpu()
+
+    def similarities_batch(self, query_embeddings: torch.Tensor) -> torch.Tensor:
+        """One row of similarities() per embed_queries() row, from a single matmul."""
+        if not self._size:
+            return torch.zeros((query_embeddings.shape[0], self._size))
+
+        return (query_embeddings.to(EMBEDDING_DTYPE) @ self._corpus[:self._size].T).float().cpu()
+
+class SemanticQueryCache:
+    """Remembers which memory ids recent queries returned, keyed by query embedding.
+
+    A new query whose embedding is within SEMANTIC_CACHE_THRESHOLD cosine of a
+    cached one (and asked for the same limit less than SEMANTIC_CACHE_TTL ago)
+    reuses that result. Entries are tagged with the caller's store version and
+    only match the same version, so bumping the version invalidates everything
+    in O(1). Expired or stale slots are skipped by lookup() and recycled
+    oldest-first.
+    """
+
+    def __init__(self, dim: int, device: str, size: int = SEMANTIC_CACHE_SIZE):
+        self._lock = threading.Lock()
+        self._embeddings = torch.zeros((size, dim), dtype=EMBEDDING_DTYPE, device=device)
+        self._entries: List[Optional[Tuple[int, float, int, List[str]]]] = [None] * size  # (version, stored_at, limit, ids)
+        self._next_slot = 0
+
+    def lookup(self, query_embedding: torch.Tensor, limit: int, version: int) -> Optional[List[str]]:
+        now = time.monotonic()
+        with self._lock:
+            # Only compare against slots that could be returned: a stale slot holding
+            # the same embedding would otherwise win argmax and shadow the fresh one
+            live = [
+                slot for slot, entry in enumerate(self._entries)
+                if entry is not None
+                and entry[0] == version
+                and entry[2] == limit
+                and now - entry[1] <= SEMANTIC_CACHE_TTL
+            ]
+            if not live:
+                return None
+            scores = torch.mv(self._embeddings[live], query_embedding.to(EMBEDDING_DTYPE))
+            best = int(torch.argmax(scores))
+            if float(scores[best]) < SEMANTIC_CACHE_THRESHOLD:
+                return None
+            return self._entries[live[best]][3]
+
+    def store(self, query_embedding: torch.Tensor, limit: int, version: int, mem_ids: List[str]):
+        with self._lock:
+            slot = self._next_slot
+            self._embeddings[slot] = query_embedding.to(EMBEDDING_DTYPE)
+            self._entries[slot] = (version, time.monotonic(), limit, mem_ids)
+            self._next_slot = (slot + 1) % len(self._entries)
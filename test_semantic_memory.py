@@ -0,0 +1,34 @@
+# memory_service/test_semantic_memory.py
+import torch
+from semantic_memory import SemanticQueryCache
+
+def _unit(dim: int, hot: int) -> torch.Tensor:
+    vec = torch.zeros(dim)
+    vec[hot] = 1.0
+    return vec
+
+def test_same_query_after_a_save_hits_the_cache_again():
+    cache = SemanticQueryCache(dim=8, device='cpu', size=4)
+    query = _unit(8, 0)
+    cache.store(query, 5, 0, ['a'])
+
+    # A save bumps the version: the old entry must miss...
+    assert cache.lookup(query, 5, 1) is None
+    # ...but once re-stored, the same embedding must hit despite the stale slot
+    cache.store(query, 5, 1, ['a', 'b'])
+    assert cache.lookup(query, 5, 1) == ['a', 'b']
+
+def test_limit_is_part_of_the_key():
+    cache = SemanticQueryCache(dim=8, device='cpu', size=4)
+    query = _unit(8, 0)
+    cache.store(query, 5, 0, ['a'])
+    cache.store(query, 10, 0, ['a', 'b'])
+
+    assert cache.lookup(query, 5, 0) == ['a']
+    assert cache.lookup(query, 10, 0) == ['a', 'b']
+    assert cache.lookup(query, 3, 0) is None
+
+def test_dissimilar_query_misses():
+    cache = SemanticQueryCache(dim=8, device='cpu', size=4)
+    cache.store(_unit(8, 0), 5, 0, ['a'])
+    assert cache.lookup(_unit(8, 1), 5, 0) is None